@@ -6,12 +6,21 @@ STM32 CMake Project Setup Script
 変更内容はCONFIGURATION部分で一元管理されています。
 """
 
+import functools
 import json
+import os
 import re
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import argparse
 
+try:
+    # 利用可能なら C 実装の orjson で JSON をパースする
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # ============================================================================
 # CONFIGURATION - 変更内容をここで定義
@@ -154,37 +163,78 @@ int _read(int file, char *ptr, int len)
 # IMPLEMENTATION - 実装部分
 # ============================================================================
 
+# 静的な正規表現はモジュールロード時に一度だけコンパイルする
+_VAR_MARKER_RE = re.compile(
+    r"(# Setup compiler settings.*?)((?:set\([^\)]+\)\n)+)", re.DOTALL
+)
+_SRC_GLOB_RE = re.compile(
+    r"# Add sources to executable\ntarget_sources\(\$\{CMAKE_PROJECT_NAME\}\s+PRIVATE\s*\n\s*# Add user sources here\s*\n\)"
+)
+_EXTRA_RE = re.compile(r"# Extra CMake configurations[\s\S]*?(?=\n#|$)", re.DOTALL)
+_BLOCK_RE = re.compile(r"(target_\w+)\(\$\{CMAKE_PROJECT_NAME\}[\s\S]*?\n\)")
+_STM32_RE = re.compile(
+    r"target_compile_definitions\([^)]+\bINTERFACE\s+[^)]*?(STM32[A-Z0-9]+xx)",
+    re.DOTALL | re.IGNORECASE,
+)
 
-class ProjectSetup:
-    """プロジェクト設定を管理するクラス"""
+# 新規追加する target_XXX() 関数に付ける修飾子（未指定は PRIVATE）
+_FUNC_MODIFIER = {
+    "target_compile_options": "PUBLIC",
+}
 
-    def __init__(self, root_dir: Path):
-        self.root_dir = root_dir
 
-    def update_cmake_presets(self, config: dict[str, any]):
-        """CMakePresets.jsonを更新"""
-        presets_file = self.root_dir / "CMakePresets.json"
+def _worker_count() -> int:
+    """I/O バウンドな並列処理に使うスレッド数"""
+    return min(32, (os.cpu_count() or 1) * 4)
 
-        with open(presets_file, "r") as f:
-            data = json.load(f)
 
-        # binaryDirを更新
-        for preset in data.get("configurePresets", []):
-            if preset.get("name") == "default":
-                preset["binaryDir"] = config["cmake_presets"]["binary_dir"]
+def _deep_merge(base: dict, override: dict) -> dict:
+    """設定 dict を再帰的にマージする
+    dict 同士は再帰マージ、list 同士は連結、それ以外は上書きする"""
+    merged = dict(base)
+    for key, value in override.items():
+        current = merged.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            merged[key] = _deep_merge(current, value)
+        elif isinstance(current, list) and isinstance(value, list):
+            merged[key] = current + value
+        else:
+            merged[key] = value
+    return merged
 
-        with open(presets_file, "w") as f:
-            json.dump(data, f, indent=4)
 
-        print(f"✓ Updated {presets_file.name}")
+@functools.lru_cache(maxsize=None)
+def _placeholder_pattern(names: tuple) -> re.Pattern:
+    """プレースホルダ名の一覧から置換用の選択パターンを一度だけ構築する"""
+    return re.compile("|".join(re.escape(name) for name in names))
 
-    def update_cmake_lists(self, config: dict[str, any]):
-        """CMakeLists.txtを更新"""
-        cmake_file = self.root_dir / "CMakeLists.txt"
 
-        with open(cmake_file, "r") as f:
-            content = f.read()
+@functools.lru_cache(maxsize=None)
+def _var_pattern(name: str) -> re.Pattern:
+    """set() 変数更新用のパターンを変数名ごとに一度だけコンパイルする"""
+    return re.compile(rf"set\({re.escape(name)}\s+[^\)]+\)")
+
+
+class ProjectSetup:
+    """プロジェクト設定を管理するクラス"""
 
+    def __init__(self, root_dir: Path):
+        self.root_dir = root_dir
+
+    def update_cmake_presets(self, data: dict[str, any], config: dict[str, any]) -> bool:
+        """CMakePresets.json のデータを更新し、変更があったかどうかを返す
+        （書き込みは run() でまとめて行う）"""
+        # binaryDirを更新
+        changed = False
+        binary_dir = config["cmake_presets"]["binary_dir"]
+        for preset in data.get("configurePresets", []):
+            if preset.get("name") == "default" and preset.get("binaryDir") != binary_dir:
+                preset["binaryDir"] = binary_dir
+                changed = True
+        return changed
+
+    def update_cmake_lists(self, content: str, config: dict[str, any]) -> str:
+        """CMakeLists.txtの内容を更新（書き込みは run() でまとめて行う）"""
         # 1. set() 変数を更新
         content = self._update_cmake_variables(content, config)
 
@@ -194,36 +244,58 @@ class ProjectSetup:
         # 3. target_XXX() 関数を更新
         content = self._update_cmake_functions(content, config)
 
-        with open(cmake_file, "w") as f:
-            f.write(content)
-
-        print(f"✓ Updated {cmake_file.name}")
+        return content
 
     def _update_cmake_variables(self, content: str, config: dict[str, any]) -> str:
         """set() で設定する変数を更新または追加"""
         variables = config.get("cmake_variables", {})
 
+        # 編集を (start, end, replacement) で収集し、最後に一度だけ結合する
+        edits = []
+        inserts = []
         for var_name, var_value in variables.items():
-            pattern = rf"set\({re.escape(var_name)}\s+[^\)]+\)"
             replacement = f"set({var_name} {var_value})"
 
-            if re.search(pattern, content):
-                # 既存の変数を更新
-                content = re.sub(pattern, replacement, content)
+            # 変数名が含まれない場合は正規表現検索を省略（文字列検索の方が高速）
+            matches = []
+            if var_name in content:
+                matches = list(_var_pattern(var_name).finditer(content))
+
+            if matches:
+                # 既存の変数をすべて更新（re.sub と同様に重複定義も正規化する）
+                for match in matches:
+                    edits.append((match.start(), match.end(), replacement))
             else:
                 # 新規追加: "# Setup compiler settings" セクションの set() の最後に追加
-                marker = r"(# Setup compiler settings.*?)((?:set\([^\)]+\)\n)+)"
-                match = re.search(marker, content, re.DOTALL)
-                if match:
-                    insert_pos = match.end(2)
-                    content = (
-                        content[:insert_pos] + f"{replacement}\n" + content[insert_pos:]
-                    )
-                else:
-                    # マーカーが見つからない場合は先頭に追加
-                    content = f"{replacement}\n\n" + content
+                inserts.append(replacement)
 
-        return content
+        if inserts:
+            joined = "".join(f"{r}\n" for r in inserts)
+            match = _VAR_MARKER_RE.search(content)
+            if match:
+                insert_pos = match.end(2)
+                edits.append((insert_pos, insert_pos, joined))
+            else:
+                # マーカーが見つからない場合は先頭に追加
+                edits.append((0, 0, joined + "\n"))
+
+        return self._apply_edits(content, edits)
+
+    @staticmethod
+    def _apply_edits(content: str, edits: list) -> str:
+        """(start, end, replacement) の編集リストを一度の結合で適用する"""
+        if not edits:
+            return content
+
+        edits.sort(key=lambda e: e[0])
+        parts = []
+        pos = 0
+        for start, end, replacement in edits:
+            parts.append(content[pos:start])
+            parts.append(replacement)
+            pos = end
+        parts.append(content[pos:])
+        return "".join(parts)
 
     def _update_source_glob(self, content: str, config: dict[str, any]) -> str:
         """file(GLOB_RECURSE) によるソースファイル追加を処理"""
@@ -244,9 +316,8 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
 )"""
 
         # 既存の target_sources を置換
-        pattern = r"# Add sources to executable\ntarget_sources\(\$\{CMAKE_PROJECT_NAME\}\s+PRIVATE\s*\n\s*# Add user sources here\s*\n\)"
-        if re.search(pattern, content):
-            content = re.sub(pattern, sources_section, content)
+        if _SRC_GLOB_RE.search(content):
+            content = _SRC_GLOB_RE.sub(sources_section, content)
 
         return content
 
@@ -254,6 +325,15 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
         """target_XXX() 関数の引数を更新または関数を追加"""
         target_funcs = config.get("cmake_functions", {})
 
+        # ファイル全体を一度だけ走査して target_XXX() ブロックの索引を作る
+        # 例: target_link_directories(${CMAKE_PROJECT_NAME} PRIVATE\n    \n)
+        index = {}
+        for m in _BLOCK_RE.finditer(content):
+            index.setdefault(m.group(1), m)
+
+        # 既存ブロックへの編集は収集して最後に一度だけ結合する
+        edits = []
+        appended = []
         for func_name, items in target_funcs.items():
             if not items:
                 continue
@@ -262,72 +342,66 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
             if func_name == "target_sources":
                 continue
 
-            # 関数のパターンを探す
-            # 例: target_link_directories(${CMAKE_PROJECT_NAME} PRIVATE\n    \n)
-            pattern = (
-                rf"({re.escape(func_name)}\(\$\{{CMAKE_PROJECT_NAME\}}[\s\S]*?)(\n\))"
-            )
-            match = re.search(pattern, content, re.DOTALL)
-
+            match = index.get(func_name)
             if match:
+                block = match.group(0)
+                # ブロック内の既存項目を一度だけ行単位でパースし、O(1) で照合する
+                existing = {line.strip() for line in block.splitlines()}
                 items_to_add = []
                 for item in items:
                     # 既に存在しない項目のみ追加
-                    if not item in match.group(0):
+                    if item.strip() not in existing:
                         items_to_add.append(item)
                 if not items_to_add:
                     continue
                 # 既存の関数に項目を追加
                 items_str = "\n    ".join(items_to_add)
-                # コメント行の後に項目を挿入
-                new_func = f"{match.group(1)}\n    {items_str}{match.group(2)}"
-                content = content[: match.start()] + new_func + content[match.end() :]
+                # コメント行の後に項目を挿入（block 末尾の "\n)" の手前）
+                new_func = f"{block[:-2]}\n    {items_str}\n)"
+                edits.append((match.start(), match.end(), new_func))
             else:
                 # 関数が存在しない場合は末尾に追加
                 items_str = "\n    ".join(items)
 
                 # 適切な修飾子を決定
-                modifier = "PRIVATE"
-                if func_name == "target_compile_options":
-                    modifier = "PUBLIC"
+                modifier = _FUNC_MODIFIER.get(func_name, "PRIVATE")
 
                 new_func = f"""\n{func_name}(${{CMAKE_PROJECT_NAME}} {modifier}
     {items_str}
 )"""
-                content = content.rstrip() + "\n" + new_func + "\n"
+                appended.append(new_func)
 
-        return content
+        content = self._apply_edits(content, edits)
+        for new_func in appended:
+            content = content.rstrip() + "\n" + new_func + "\n"
 
-    def update_cmake_extra(self, config: dict[str, any]):
-        """CMakeLists.txt に extra セクションを追加"""
-        cmake_file = self.root_dir / "CMakeLists.txt"
-
-        with open(cmake_file, "r") as f:
-            content = f.read()
+        return content
 
+    def update_cmake_extra(self, content: str, config: dict[str, any]) -> str:
+        """CMakeLists.txt の内容に extra セクションを追加（書き込みは run() でまとめて行う）"""
         extra = config.get("extra", "").strip()
         if extra:
-            # 既存の extra セクションを削除
-            pattern = r"# Extra CMake configurations[\s\S]*?(?=\n#|$)"
-            content = re.sub(pattern, "", content, flags=re.DOTALL).rstrip()
+            # 既存の extra セクションを削除（セクションが無ければ走査を省略）
+            if "# Extra CMake configurations" in content:
+                content, _ = _EXTRA_RE.subn("", content, count=1)
+            content = content.rstrip()
 
             # 末尾に追加
             content += f"\n\n# Extra CMake configurations\n{extra}\n"
 
-        with open(cmake_file, "w") as f:
-            f.write(content)
-
-        print(f"✓ Updated extra section in {cmake_file.name}")
+        return content
 
-    def copy_resources(self, config: dict[str, any]) -> set:
-        """resources 配下のファイルを実行ディレクトリへ展開し、コピーされたファイルのセットを返す"""
+    def copy_resources(self, config: dict[str, any]) -> tuple[set, set]:
+        """resources 配下のファイルを実行ディレクトリへ展開し、
+        コピーされたファイルとディレクトリのセットを返す"""
         cfg = config.get("resources", {})
         paths: list[str] = cfg.get("paths", [])
         copied_files = set()
+        copied_dirs = set()
 
         if not paths:
             print("! No resource paths configured; skipped copying.")
-            return copied_files
+            return copied_files, copied_dirs
 
         dest_root = Path.cwd()
         script_dir = Path(__file__).resolve().parent
@@ -342,21 +416,23 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
                 candidates.append(script_dir / p)
                 candidates.append(dest_root / p)
 
-            src_dir = next((c for c in candidates if c.exists() and c.is_dir()), None)
+            # os.path.isdir は exists() + is_dir() の二重 stat を一回で済ませる
+            src_dir = next((c for c in candidates if os.path.isdir(c)), None)
             if src_dir is None:
                 continue
 
-            files = self._copy_tree(src_dir, dest_root)
+            files, dirs = self._copy_tree(src_dir, dest_root)
             copied_files.update(files)
+            copied_dirs.update(dirs)
             copied_any = True
             print(f"✓ Copied resources from {src_dir} to {dest_root}")
 
         if not copied_any:
             print("! No resource directories found; skipped copying.")
 
-        return copied_files
+        return copied_files, copied_dirs
 
-    def post_process_projectname(self, dest_root: Path, copied_files: set, config: dict[str, any]):
+    def post_process_projectname(self, dest_root: Path, copied_files: set, copied_dirs: set, config: dict[str, any]):
         """コピー後の置換処理:
         - `projectname` というディレクトリ名をルート名に置換（コピーされたファイルのみ）
         - ソース内の `{{PROJECTNAME}}` をルート名に置換（コピーされたファイルのみ）
@@ -364,54 +440,51 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
         - ソースファイルへの自動挿入処理
         """
         project_name = dest_root.name
-        stm32_type = self._extract_stm32_type()
+        stm32_type = self._stm32_type
         renamed_files = set()
 
         # 1) ディレクトリ名 'projectname' をプロジェクト名に置換（コピーされたディレクトリのみ）
-        # コピーされたファイルから親ディレクトリを抽出
-        copied_dirs = set()
-        for f in copied_files:
-            for parent in f.parents:
-                if parent == dest_root:
-                    break
-                copied_dirs.add(parent)
-
-        for d in sorted(copied_dirs, key=lambda x: len(x.parts), reverse=True):
-            if d.is_dir() and d.name == "projectname":
+        # 親ディレクトリは _copy_tree がコピー時に記録済み
+        projectname_dirs = [d for d in copied_dirs if d.name == "projectname"]
+
+        # コピー済みファイルを projectname ディレクトリごとに一度だけ分類しておく
+        # （リネームのたびに copied_files 全体を走査しないため）
+        by_dir = {d: [] for d in projectname_dirs}
+        if by_dir:
+            for f in copied_files:
+                for d in projectname_dirs:
+                    if d in f.parents:
+                        by_dir[d].append(f)
+                        break
+
+        for d in sorted(projectname_dirs, key=lambda x: len(x.parts), reverse=True):
+            if d.is_dir():
                 target = d.parent / project_name
+                moved = by_dir.get(d, [])
                 if target.exists():
                     # 既に存在する場合はマージ—ファイルをコピーして上書き
-                    for srcfile in d.rglob("*"):
-                        if srcfile.is_file():
-                            rel = srcfile.relative_to(d)
-                            destfile = target / rel
-                            destfile.parent.mkdir(parents=True, exist_ok=True)
-                            shutil.copy2(srcfile, destfile)
-                            # リネーム後のファイルパスを記録
-                            if srcfile in copied_files:
-                                copied_files.discard(srcfile)
-                                renamed_files.add(destfile)
-                    # 元の空ディレクトリは削除
+                    # os.walk は scandir ベースで、rglob + is_file() より stat が少ない
+                    d_str = str(d)
+                    prefix_len = len(d_str) + 1
+                    for dirpath, _, filenames in os.walk(d_str):
+                        if not filenames:
+                            continue
+                        rel_dir = dirpath[prefix_len:]
+                        dst_dir = (target / rel_dir) if rel_dir else target
+                        dst_dir.mkdir(parents=True, exist_ok=True)
+                        for name in filenames:
+                            shutil.copy2(os.path.join(dirpath, name), dst_dir / name)
+                    # 元のディレクトリは削除
                     try:
-                        for sub in sorted(d.rglob("*"), reverse=True):
-                            if sub.is_file():
-                                sub.unlink()
-                        d.rmdir()
-                    except Exception:
+                        shutil.rmtree(d)
+                    except OSError:
                         pass
                 else:
                     # ディレクトリをリネーム
-                    # リネームされたファイルパスを更新
-                    for srcfile in list(copied_files):
-                        try:
-                            rel = srcfile.relative_to(d)
-                            new_file = target / rel
-                            copied_files.discard(srcfile)
-                            renamed_files.add(new_file)
-                        except ValueError:
-                            # このファイルは d の配下ではない
-                            pass
                     d.rename(target)
+                # リネームされたファイルパスを一括で更新
+                copied_files.difference_update(moved)
+                renamed_files.update(target / f.relative_to(d) for f in moved)
                 print(f"✓ Renamed directory {d} -> {target}")
 
         # リネームされたファイルをコピーリストに追加
@@ -420,24 +493,47 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
         # 2) ファイル内のプレースホルダ置換（コピーされたファイルのみ）
         placeholders = {"{{PROJECTNAME}}": project_name, "{{STM32TYPE}}": stm32_type}
 
-        for f in copied_files:
+        # ループ不変の参照はローカルに束縛し、ファイルごとの属性参照と
+        # クロージャ生成を避ける
+        def _replace(m):
+            return placeholders[m.group(0)]
+
+        subn_placeholders = _placeholder_pattern(tuple(placeholders)).subn
+
+        def _process_one(f: Path):
+            """1ファイルのプレースホルダを置換し、変更した場合のみパスを返す"""
             if not f.is_file():
-                continue
+                return None
             try:
-                text = f.read_text(encoding="utf-8")
-            except Exception:
-                # バイナリや読めないファイルはスキップ
-                continue
+                data = f.read_bytes()
+            except OSError:
+                # 読めないファイルはスキップ
+                return None
 
-            modified = False
-            for placeholder, replacement in placeholders.items():
-                if placeholder in text:
-                    text = text.replace(placeholder, replacement)
-                    modified = True
+            # バイナリファイル（先頭に NUL を含む）とプレースホルダを
+            # 含まないファイルはデコードせずスキップ
+            if b"\x00" in data[:4096] or b"{{" not in data:
+                return None
 
-            if modified:
-                f.write_text(text, encoding="utf-8")
-                print(f"✓ Replaced placeholders in {f}")
+            try:
+                text = data.decode("utf-8")
+            except UnicodeDecodeError:
+                # バイナリファイルはスキップ
+                return None
+
+            # 一度の走査で全プレースホルダを置換
+            new_text, n = subn_placeholders(_replace, text)
+            if not n:
+                return None
+            f.write_bytes(new_text.encode("utf-8"))
+            return f
+
+        # 読み書きが中心の I/O バウンド処理なのでスレッドプールで並列化する
+        # （出力が混ざらないよう print はメインスレッドでまとめて行う）
+        with ThreadPoolExecutor(max_workers=_worker_count()) as executor:
+            for f in executor.map(_process_one, copied_files):
+                if f is not None:
+                    print(f"✓ Replaced placeholders in {f}")
 
         # 3) ソースファイルへの自動挿入処理
         self._inject_to_source_files(dest_root, project_name, config=config)
@@ -473,8 +569,20 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
             except Exception:
                 src = ""
 
-            new_src = src
-            changed = False
+            # チェック文字列の有無は一度の走査でまとめて調べる
+            checks = {inj.get("check") for inj in file_injections if inj.get("check")}
+            present_checks = set()
+            if checks:
+                check_re = re.compile(
+                    "|".join(
+                        re.escape(c) for c in sorted(checks, key=len, reverse=True)
+                    )
+                )
+                present_checks = set(check_re.findall(src))
+
+            # マーカー位置ごとに挿入内容を収集し、最後に一度だけ結合・書き込みする
+            pending = {}  # marker -> (挿入位置, 挿入内容のリスト)
+            inserted_contents = []
 
             for injection in file_injections:
                 marker = injection.get("marker")
@@ -490,39 +598,159 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
                 else:
                     content = content_template
 
-                # マーカーが存在し、チェック文字列が含まれていない場合に挿入
-                if marker in new_src and (not check or check not in new_src):
-                    parts = new_src.split(marker, 1)
-                    new_src = parts[0] + marker + "\n" + content + "\n" + parts[1]
-                    changed = True
+                # マーカー位置は find() 一回で取得（in + split の二重走査を避ける）
+                if marker in pending:
+                    insert_pos = pending[marker][0]
+                else:
+                    idx = src.find(marker)
+                    if idx < 0:
+                        continue
+                    insert_pos = idx + len(marker)
+                    pending[marker] = (insert_pos, [])
+
+                # チェック文字列が既に存在する場合は挿入しない（挿入済み内容も考慮）
+                if check and (
+                    check in present_checks
+                    or any(check in c for c in inserted_contents)
+                ):
+                    continue
 
-            if changed:
-                target_file.write_text(new_src, encoding="utf-8")
+                # 同一マーカーへの後続挿入はマーカー直後に来る（従来挙動を維持）
+                pending[marker][1].insert(0, content)
+                inserted_contents.append(content)
+
+            edits = [
+                (pos, pos, "".join(f"\n{c}\n" for c in contents))
+                for pos, contents in pending.values()
+                if contents
+            ]
+            if edits:
+                target_file.write_text(self._apply_edits(src, edits), encoding="utf-8")
                 print(f"✓ Modified {target_file}")
 
-    def _copy_tree(self, src: Path, dest_root: Path) -> set:
-        """src 配下のファイルを dest_root へ相対パスを保ってコピーし、コピーされたファイルのセットを返す
+    def _copy_tree(self, src: Path, dest_root: Path) -> tuple[set, set]:
+        """src 配下のファイルを dest_root へ相対パスを保ってコピーし、
+        コピーされたファイルと（dest_root を除く）親ディレクトリのセットを返す
         既存のファイルがある場合は上書きしない"""
         copied_files = set()
-        for path in src.rglob("*"):
-            if path.is_dir():
-                continue
+        dir_strs = set()
+        tasks = []
+        dest_root_str = str(dest_root)
+        self._copy_tree_scandir(
+            str(src), dest_root_str, dest_root_str, copied_files, dir_strs, tasks
+        )
 
-            rel = path.relative_to(src)
-            dest_path = dest_root / rel
+        # ファイルコピーは I/O バウンドなのでスレッドプールで並列実行する
+        if tasks:
+            with ThreadPoolExecutor(max_workers=_worker_count()) as executor:
+                for _ in executor.map(
+                    lambda task: self._copy_file(*task), tasks
+                ):
+                    pass
+        # Path オブジェクトへの変換は最後に一度だけ行う
+        return copied_files, {Path(s) for s in dir_strs}
+
+    def _copy_tree_scandir(
+        self,
+        src_dir: str,
+        dest_dir: str,
+        dest_root_str: str,
+        copied_files: set,
+        dir_strs: set,
+        tasks: list,
+    ):
+        """os.scandir で src_dir を走査しながらファイルをコピーする
+        DirEntry の is_dir() はキャッシュされるため rglob より stat 呼び出しが少なく、
+        パスは文字列のまま組み立てて Path オブジェクトの生成を最小限にする"""
+        with os.scandir(src_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    self._copy_tree_scandir(
+                        entry.path,
+                        os.path.join(dest_dir, entry.name),
+                        dest_root_str,
+                        copied_files,
+                        dir_strs,
+                        tasks,
+                    )
+                    continue
 
-            # 既存ファイルがある場合はスキップ
-            if dest_path.exists():
-                print(f"  Skipped (already exists): {dest_path}")
-                continue
+                # ディレクトリへのシンボリックリンクは辿らずスキップ
+                # （rglob ベースのコピーと同じ挙動）
+                if entry.is_symlink() and entry.is_dir():
+                    continue
 
-            dest_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(path, dest_path)
-            copied_files.add(dest_path)
-        return copied_files
+                dest_str = os.path.join(dest_dir, entry.name)
+
+                # 既存ファイルがある場合はスキップ
+                if os.path.lexists(dest_str):
+                    print(f"  Skipped (already exists): {dest_str}")
+                    continue
 
-    def _extract_stm32_type(self) -> str:
-        """cmake/stm32cubemx/CMakeLists.txt から STM32 型名を抽出"""
+                os.makedirs(dest_dir, exist_ok=True)
+                tasks.append((entry.path, dest_str))
+                copied_files.add(Path(dest_str))
+
+                # 親ディレクトリをコピー時に文字列のまま記録
+                # （後段での parents 再走査と Path 生成を不要にする）
+                parent = dest_dir
+                while parent != dest_root_str and parent not in dir_strs:
+                    dir_strs.add(parent)
+                    parent = os.path.dirname(parent)
+
+    @staticmethod
+    def _copy_file(src_path, dest_path):
+        """1ファイルをコピーする
+        copy_file_range / sendfile によるカーネル内コピーを試み、
+        使えない環境では shutil.copyfile にフォールバックする"""
+        done = False
+        try:
+            with open(src_path, "rb") as fsrc, open(dest_path, "wb") as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                done = ProjectSetup._kernel_copy(fsrc.fileno(), fdst.fileno(), size)
+        except OSError:
+            done = False
+        if not done:
+            shutil.copyfile(src_path, dest_path)
+        shutil.copystat(src_path, dest_path)
+
+    @staticmethod
+    def _kernel_copy(src_fd: int, dst_fd: int, size: int) -> bool:
+        """カーネル内コピーを試み、全バイトコピーできた場合のみ True を返す"""
+        copied = 0
+        try:
+            while copied < size:
+                n = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            pass
+        if copied >= size:
+            return True
+        if copied:
+            # 中途半端に書けた場合はフルコピーでやり直す
+            return False
+
+        # copy_file_range が使えない場合は sendfile を試す
+        try:
+            while copied < size:
+                n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            return False
+        return copied >= size
+
+    @functools.cached_property
+    def _stm32_type(self) -> str:
+        """cmake/stm32cubemx/CMakeLists.txt から抽出した STM32 型名
+        （初回アクセス時に検出し、以降はキャッシュを返す）"""
+        return self._detect_stm32_type()
+
+    def _detect_stm32_type(self) -> str:
+        """cmake/stm32cubemx/CMakeLists.txt を読み込んで STM32 型名を検出"""
         cubemx_cmake = self.root_dir / "cmake" / "stm32cubemx" / "CMakeLists.txt"
 
         if not cubemx_cmake.exists():
@@ -530,17 +758,25 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
             return "STM32F405xx"
 
         try:
-            content = cubemx_cmake.read_text(encoding="utf-8")
+            data = cubemx_cmake.read_bytes()
         except Exception:
             print(f"! Failed to read {cubemx_cmake}; using default STM32 type")
             return "STM32F405xx"
 
+        # "STM32" を含まない場合はデコードも正規表現検索も省略
+        if b"STM32" not in data:
+            print(f"! STM32 type not found in {cubemx_cmake}; using default")
+            return "STM32F405xx"
+
+        try:
+            content = data.decode("utf-8")
+        except UnicodeDecodeError:
+            print(f"! Failed to read {cubemx_cmake}; using default STM32 type")
+            return "STM32F405xx"
+
         # target_compile_definitions 内の STM32xxxxx パターンを探す
         # 例: STM32F405xx, STM32G431xx, STM32H7xx など
-        pattern = (
-            r"target_compile_definitions\([^)]+\bINTERFACE\s+[^)]*?(STM32[A-Z0-9]+xx)"
-        )
-        match = re.search(pattern, content, re.DOTALL | re.IGNORECASE)
+        match = _STM32_RE.search(content)
 
         if match:
             stm32_type = match.group(1)
@@ -554,32 +790,52 @@ target_sources(${{CMAKE_PROJECT_NAME}} PRIVATE
         """すべての更新を実行"""
         print("Starting project setup...\n")
 
-        # ベース設定で更新
-        self.update_cmake_lists(config=CONFIG)
-        self.update_cmake_extra(config=CONFIG)
-        
-        # プロファイル設定をマージ
-        merged_config = CONFIG.copy()
+        # ベース設定と選択されたプロファイルを一度だけディープマージし、
+        # 各更新フェーズはマージ結果に対して一回だけ実行する
+        merged_config = CONFIG
+        profile_applied = False
         for profile in profiles:
             profile_cfg = CONFIG.get("profiles", {}).get(profile, {})
             if not profile_cfg:
                 print(f"! Profile '{profile}' not found; skipping.")
                 continue
-            print(f"\nApplying profile: {profile}")
-            # プロファイルごとに CMakeLists.txt を更新
-            self.update_cmake_presets(config={**CONFIG, **profile_cfg})
-            self.update_cmake_lists(config={**CONFIG, **profile_cfg})
-            self.update_cmake_extra(config={**CONFIG, **profile_cfg})
-            
-            # source_file_injectionsをマージ
-            if "source_file_injections" in profile_cfg:
-                if "source_file_injections" not in merged_config:
-                    merged_config["source_file_injections"] = []
-                merged_config["source_file_injections"].extend(profile_cfg["source_file_injections"])
+            print(f"Applying profile: {profile}")
+            merged_config = _deep_merge(merged_config, profile_cfg)
+            profile_applied = True
+
+        # CMakeLists.txt は一度だけ読み込み、全更新適用後に一度だけ書き戻す
+        cmake_file = self.root_dir / "CMakeLists.txt"
+        with open(cmake_file, "r") as f:
+            original_content = f.read()
+
+        content = self.update_cmake_lists(original_content, config=merged_config)
+        content = self.update_cmake_extra(content, config=merged_config)
+
+        # 内容に変化がない場合は書き込みを省略
+        if content != original_content:
+            with open(cmake_file, "w") as f:
+                f.write(content)
+            print(f"✓ Updated {cmake_file.name}")
+        else:
+            print(f"✓ {cmake_file.name} is up to date")
+
+        # CMakePresets.json はプロファイル適用時のみ更新（従来挙動）
+        # 変更がない場合は JSON のシリアライズと書き込みを省略
+        if profile_applied:
+            presets_file = self.root_dir / "CMakePresets.json"
+            if orjson is not None:
+                presets_data = orjson.loads(presets_file.read_bytes())
+            else:
+                with open(presets_file, "r") as f:
+                    presets_data = json.load(f)
+            if self.update_cmake_presets(presets_data, config=merged_config):
+                with open(presets_file, "w") as f:
+                    json.dump(presets_data, f, indent=4)
+                print(f"✓ Updated {presets_file.name}")
         
-        copied_files = self.copy_resources(config=CONFIG)
+        copied_files, copied_dirs = self.copy_resources(config=CONFIG)
         # resources を実行ディレクトリへ展開した後、projectname の置換等を行う（コピーされたファイルのみ）
-        self.post_process_projectname(Path.cwd(), copied_files, config=merged_config)
+        self.post_process_projectname(Path.cwd(), copied_files, copied_dirs, config=merged_config)
 
         print("\n✓ All files updated successfully!")
 